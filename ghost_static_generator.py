@@ -4,6 +4,7 @@ import sys
 import subprocess
 import argparse
 import copy
+import importlib.metadata
 
 # Check if running as root
 if os.geteuid() == 0:
@@ -17,15 +18,17 @@ if sys.prefix == sys.base_prefix:
     print("If you haven't set up a virtual environment, you can do so with these commands:")
     print("python3 -m venv ghost-static-env")
     print("source ghost-static-env/bin/activate")
-    print("pip install pillow-avif-plugin requests beautifulsoup4 pillow gitpython")
+    print("pip install pillow-avif-plugin requests beautifulsoup4 lxml pillow gitpython")
     sys.exit(1)
 
 # Check if required packages are installed
-required_packages = ['pillow-avif-plugin', 'requests', 'beautifulsoup4', 'pillow', 'gitpython']
-installed_packages = subprocess.check_output([sys.executable, '-m', 'pip', 'freeze']).decode().split('\n')
-installed_packages = [package.split('==')[0].lower() for package in installed_packages]
+required_packages = ['pillow-avif-plugin', 'requests', 'beautifulsoup4', 'lxml', 'pillow', 'gitpython']
+# Read installed distributions in-process rather than shelling out to pip freeze
+installed_packages = {(distribution.metadata['Name'] or '').lower().replace('_', '-') for distribution in importlib.metadata.distributions()}
 
-missing_packages = [package for package in required_packages if package.lower() not in installed_packages]
+# Pillow-SIMD is a drop-in replacement for Pillow with SSE4/AVX2 resize and convert paths
+package_alternatives = {'pillow': ['pillow', 'pillow-simd']}
+missing_packages = [package for package in required_packages if not any(alternative in installed_packages for alternative in package_alternatives.get(package, [package.lower()]))]
 
 if missing_packages:
     print("The following required packages are missing:")
@@ -37,31 +40,379 @@ if missing_packages:
 
 import urllib.request
 import urllib.parse
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+import html
+import lxml.html
+from lxml import etree
 import re
 import shutil
 import git
 from PIL import Image
+import pillow_avif  # registers the AVIF plugin with Pillow
+# libvips is optional; when its bindings are installed it replaces Pillow for WebP/AVIF encoding
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
 import concurrent.futures
+import functools
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
+import queue
 from urllib.parse import urljoin, urlparse
 import time
 import mimetypes
-import imghdr
+import json
+import hashlib
+import tempfile
+import mmap
+import email.utils
 import logging
 import shutil
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Files are always saved as UTF-8, so don't let lxml guess the encoding
+HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+
+IMG_TAG_RE = re.compile(rb'<img\b', re.IGNORECASE)
+# Stops at the first quote or closing paren, so several url() values in one declaration
+# are matched separately instead of backtracking from the end of the string
+CSS_URL_RE = re.compile(r'url\(["\']?([^"\')]+)', re.ASCII)
+STYLE_ATTR_RE = re.compile(r'\sstyle\s*=\s*(["\'])(.*?)\1', re.IGNORECASE | re.DOTALL)
+IFRAME_RESOURCE_RE = re.compile(r'(["\'`])((?:\.{1,2}\/)*(?:[\w-]+\/)*[\w-]+\.(?:jpg|jpeg|png|gif|svg|js|css))\1')
+
+# The crawler only reads tags that can reference other resources, so BeautifulSoup
+# skips building the rest of the tree
+CRAWL_STRAINER = SoupStrainer(['a', 'link', 'script', 'img', 'source', 'style', 'iframe', 'meta'])
+IFRAME_STRAINER = SoupStrainer(['script', 'link', 'img'])
+
+# Query parameters that only track the visitor; pages differing only in these are the same
+TRACKING_QUERY_KEYS = frozenset({'gclid', 'fbclid'})
+
+# Source formats that convert_images encodes to WebP, AVIF and JXL
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif'}
+
+# Sources smaller than this are served as is; an encoded copy that is not at least
+# 10% smaller than its source is discarded so the HTML never points at it
+MIN_TRANSCODE_BYTES = 8 * 1024
+MAX_OUTPUT_RATIO = 0.9
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a')
+
+def _has_image_signature(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(12).startswith(IMAGE_SIGNATURES)
+    except OSError:
+        return False
+
+FORMAT_NAMES = {'webp': 'WebP', 'avif': 'AVIF', 'jxl': 'JXL'}
+# <source> types added to each <picture>; each is inserted at the front, so JXL ends up first and WebP last
+SOURCE_TYPES = {'webp': 'image/webp', 'avif': 'image/avif', 'jxl': 'image/jxl'}
+
+# Threads each encoder may use inside a conversion worker and the AVIF speed preset
+# (0 slowest/best to 10 fastest); set by _init_encoder_worker
+_encoder_threads = 1
+_avif_speed = 6
+
+def _init_encoder_worker(encoder_threads, avif_speed):
+    global _encoder_threads, _avif_speed
+    _encoder_threads = encoder_threads
+    _avif_speed = avif_speed
+    if pyvips is not None:
+        # Every image is read once, so the operation cache would only cost memory
+        pyvips.cache_set_max(0)
+        pyvips.concurrency_set(encoder_threads)
+
+def _open_with_pillow(img_path):
+    img = Image.open(img_path)
+    img.load()
+    if img.mode not in ('RGB', 'RGBA'):
+        has_alpha = img.mode in ('LA', 'PA') or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+    return img
+
+def _save_with_pillow(img, format_ext, output_path):
+    if format_ext == 'webp':
+        img.save(output_path, 'WEBP', quality=80)
+    else:
+        img.save(output_path, 'AVIF', speed=_avif_speed, max_threads=_encoder_threads)
+
+def _save_with_vips(img_path, format_ext, output_path):
+    # A sequential image is decoded in small strips as the encoder pulls them, so the
+    # full frame is never held in memory; it can only be read once, hence one per format.
+    # Metadata is stripped, matching what Pillow writes by default
+    img = pyvips.Image.new_from_file(img_path, access='sequential')
+    if format_ext == 'webp':
+        img.webpsave(output_path, Q=80, strip=True)
+    else:
+        # libvips expresses the preset as effort, the inverse of the encoder speed
+        img.heifsave(output_path, Q=75, compression='av1', effort=max(0, 9 - _avif_speed), strip=True)
+
+def _save_with_cjxl(img_path, output_path):
+    # cjxl reads the original file so JPEGs are transcoded losslessly without a decode
+    subprocess.run(['cjxl', img_path, output_path, f'--num_threads={_encoder_threads}'], check=True)
+
+def _convert_image(img_path, formats=('webp', 'avif', 'jxl'), force_reconvert=False):
+    base_path = os.path.splitext(img_path)[0]
+
+    # An output is current when it is at least as new as its source
+    source_stat = os.stat(img_path)
+    source_mtime = source_stat.st_mtime
+    def is_current(output_path):
+        return not force_reconvert and os.path.exists(output_path) and os.path.getmtime(output_path) >= source_mtime
+
+    written_paths = []
+    discarded_paths = []
+    failed = False
+    outputs = []
+    for format_ext in formats:
+        output_path = f"{base_path}.{format_ext}"
+        if is_current(output_path):
+            logging.info(f"{FORMAT_NAMES[format_ext]} already up to date, skipping: {img_path}")
+        else:
+            outputs.append((format_ext, output_path))
+
+    pillow_image = None
+    if pyvips is None and any(format_ext != 'jxl' for format_ext, _ in outputs):
+        # Decode the source once and encode every Pillow format from the same pixels
+        try:
+            pillow_image = _open_with_pillow(img_path)
+        except Exception as e:
+            logging.error(f"Error decoding {img_path}: {str(e)}")
+            failed = True
+            outputs = [(format_ext, output_path) for format_ext, output_path in outputs if format_ext == 'jxl']
+
+    for format_ext, output_path in outputs:
+        format_name = FORMAT_NAMES[format_ext]
+        try:
+            if format_ext == 'jxl':
+                _save_with_cjxl(img_path, output_path)
+            elif pyvips is not None:
+                _save_with_vips(img_path, format_ext, output_path)
+            else:
+                _save_with_pillow(pillow_image, format_ext, output_path)
+            if os.path.getsize(output_path) >= source_stat.st_size * MAX_OUTPUT_RATIO:
+                os.remove(output_path)
+                discarded_paths.append(output_path)
+                logging.info(f"{format_name} output not smaller than source, discarded: {img_path}")
+                continue
+            written_paths.append(output_path)
+            logging.info(f"Converted to {format_name}: {img_path}")
+        except FileNotFoundError as e:
+            if format_ext == 'jxl':
+                logging.error("cjxl command not found. Please ensure JPEG XL tools are installed.")
+            else:
+                logging.error(f"Error converting {img_path} to {format_name}: {str(e)}")
+            failed = True
+        except Exception as e:
+            logging.error(f"Error converting {img_path} to {format_name}: {str(e)}")
+            failed = True
+
+    return written_paths, discarded_paths, not failed
+
+def _canonical_url(url):
+    # Deduplication key for the crawl, never fetched: no fragment, no tracking parameters,
+    # sorted query, an empty path as /, and /post/index.html folded into /post/ since
+    # all of these are saved to the same file
+    scheme, netloc, path, query, _ = urllib.parse.urlsplit(url)
+    if not path:
+        path = '/'
+    elif path.endswith('/index.html'):
+        path = path[:-len('index.html')]
+    if query:
+        params = [(key, value) for key, value in urllib.parse.parse_qsl(query, keep_blank_values=True)
+                  if not key.startswith('utm_') and key not in TRACKING_QUERY_KEYS]
+        query = urllib.parse.urlencode(sorted(params))
+    return urllib.parse.urlunsplit((scheme, netloc.lower(), path, query, ''))
+
+def _url_to_local_path(url, public_dir, local_netlocs):
+    if url.startswith('/'):
+        return os.path.join(public_dir, url.lstrip('/'))
+    # Plain absolute URLs (no query or fragment) only need a string split, not urlparse
+    scheme, separator, rest = url.partition('://')
+    if separator and scheme in ('http', 'https') and '?' not in rest and '#' not in rest:
+        netloc, _, path = rest.partition('/')
+        if netloc not in local_netlocs:
+            return None
+        return os.path.join(public_dir, path.lstrip('/'))
+    parsed_url = urllib.parse.urlparse(url)
+    if parsed_url.netloc and parsed_url.netloc not in local_netlocs:
+        return None
+    relative_path = parsed_url.path.lstrip('/')
+    return os.path.join(public_dir, relative_path)
+
+# Settings for HTML rewrite worker processes; set once per process so the
+# file set isn't pickled for every task
+_html_rewrite_config = None
+
+def _init_html_rewrite_worker(public_dir, source_url, target_url, local_files):
+    global _html_rewrite_config
+    local_netlocs = (urlparse(source_url).netloc, urlparse(target_url).netloc)
+    _html_rewrite_config = (public_dir, source_url, target_url, local_netlocs, local_files)
+
+def _write_if_changed(file_path, original_content, content):
+    # Returns the digest of the final content and whether the file was rewritten
+    if content != original_content:
+        with open(file_path, 'wb') as f:
+            f.write(content)
+        logging.debug("Updated %s", file_path)
+    return hashlib.sha256(content).hexdigest(), content != original_content
+
+# Stand-in tag for <source> during serialization; it can't clash with anything in the page
+VOID_SOURCE_TAG = b'ghost-static-void-source'
+
+def _close_source_elements(root):
+    # libxml2 doesn't know <source> is a void element: it nests whatever follows an
+    # unclosed <source> inside it and would serialize an end tag. Move that content back
+    # out after the element, then rename every (now empty) source so it can be written
+    # self-closing, which also keeps the next run from nesting the img inside it
+    for source in list(root.iter('source')):
+        children = list(source)
+        tail = source.tail
+        source.tail, source.text = source.text, None
+        for child in reversed(children):
+            source.addnext(child)
+        last = children[-1] if children else source
+        last.tail = (last.tail or '') + (tail or '') or None
+        source.tag = VOID_SOURCE_TAG.decode()
+
+def _rewrite_one_html(file_path, current_digest=None):
+    # The rewrite is idempotent, so it works on fresh pages from Ghost as well as on
+    # pages kept from an earlier run; current_digest is the recorded digest of this
+    # file's last output when nothing it depends on has changed since
+    public_dir, source_url, target_url, local_netlocs, local_files = _html_rewrite_config
+
+    def update_url(url):
+        return url.replace(source_url, target_url)
+
+    logging.debug("Processing HTML file: %s", file_path)
+    with open(file_path, 'rb') as f:
+        original_content = f.read()
+    if current_digest and hashlib.sha256(original_content).hexdigest() == current_digest:
+        logging.debug("Unchanged since the last run, skipping: %s", file_path)
+        return current_digest, False
+
+    # Without any <img> the rewrite reduces to the URL replacement, so skip building a tree
+    if not IMG_TAG_RE.search(original_content):
+        content = original_content.replace(source_url.encode(), target_url.encode())
+        return _write_if_changed(file_path, original_content, content)
+    
+    try:
+        root = lxml.html.document_fromstring(original_content, parser=HTML_PARSER)
+    except etree.ParserError as e:
+        logging.warning("Skipping unparseable HTML file %s: %s", file_path, e)
+        return None, False
+    images_processed = 0
+
+    # Update Open Graph meta tags
+    og_images = root.xpath('//meta[@property="og:image"][@content]')
+    if og_images:
+        og_image = og_images[0]
+        og_image.set('content', update_url(og_image.get('content')))
+        logging.debug("Updated og:image: %s", og_image.get('content'))
+
+    for img in list(root.iter('img')):
+        src = img.get('src') or img.get('data-src')
+        if not src:
+            logging.warning("Image without src found in %s", file_path)
+            continue
+
+        logging.debug("Processing image with src: %s", src)
+
+        original_srcset = img.get('srcset') or img.get('data-srcset', '')
+        sizes = img.get('sizes', '')
+
+        # Update src and srcset to use target URL
+        img.set('src', update_url(src))
+        if original_srcset:
+            img.set('srcset', ', '.join([f"{update_url(s.split()[0])} {s.split()[1]}" if len(s.split()) > 1 else update_url(s) for s in original_srcset.split(',')]))
+
+        # Create picture tag in the img's place; the text after the img stays outside it.
+        # An img already in a picture was handled by an earlier run, so regenerate its sources
+        parent = img.getparent()
+        if parent.tag == 'picture':
+            picture = parent
+            for source in picture.findall('source'):
+                if source.get('type') in SOURCE_TYPES.values():
+                    picture.remove(source)
+        else:
+            picture = img.makeelement('picture', {})
+            picture.tail, img.tail = img.tail, None
+            parent.replace(img, picture)
+            picture.append(img)
+
+        # Parse the srcset once; each format only swaps the extension on these bases
+        candidates = []
+        for src_entry in original_srcset.split(','):
+            parts = src_entry.split()
+            if not parts:
+                continue
+            if len(parts) == 2:
+                orig_src, width = parts
+                base_src, dot, _ = orig_src.rpartition('.')
+                local_base = _url_to_local_path(base_src, public_dir, local_netlocs) if dot else None
+                if local_base:
+                    candidates.append((update_url(base_src), local_base, width))
+                    continue
+            # A <source> missing one of the widths would leave the browser a partial set
+            candidates = []
+            break
+
+        for format_ext, format_type in SOURCE_TYPES.items():
+            # Only offer a format that exists for every width; a skipped or discarded
+            # conversion leaves the browser on the original srcset instead
+            if candidates and all(f"{local_base}.{format_ext}" in local_files for _, local_base, _ in candidates):
+                srcset = [f"{base_src}.{format_ext} {width}" for base_src, _, width in candidates]
+                source = picture.makeelement('source', {'type': format_type})
+                source.set('srcset', ', '.join(srcset))
+                if sizes:
+                    source.set('sizes', sizes)
+                picture.insert(0, source)
+                logging.debug("Created source for %s", format_type)
+
+        # Ensure lazy loading
+        img.set('loading', 'lazy')
+        
+        images_processed += 1
+    
+    logging.info("Processed %d images in %s", images_processed, file_path)
+    
+    # Serialize and update all URLs in the HTML content in one go
+    _close_source_elements(root)
+    content = lxml.html.tostring(root.getroottree(), encoding='utf-8')
+    content = content.replace(b'<' + VOID_SOURCE_TAG, b'<source').replace(b'></' + VOID_SOURCE_TAG + b'>', b'/>')
+    content = content.replace(source_url.encode(), target_url.encode())
+    return _write_if_changed(file_path, original_content, content)
+
+
 class ImprovedGhostStaticGenerator:
-    def __init__(self, source_url, target_url, repo_path, force_reconvert=False):
+    def __init__(self, source_url, target_url, repo_path, force_reconvert=False, max_workers=16, avif_speed=6):
         self.source_url = source_url
         self.target_url = target_url
+        self.source_netloc = urlparse(source_url).netloc
         self.repo_path = repo_path
         self.public_dir = os.path.join(repo_path, 'public')
         self.visited_urls = set()
         self.file_urls = set()
+        self.public_files = None
+        self.created_dirs = set()
+        self.written_paths = set()
+        self.removed_paths = set()
+        self.manifest_path = os.path.join(repo_path, '.build-manifest.json')
+        self.http_cache_path = os.path.join(repo_path, '.http-cache.json')
+        self.http_cache = {}
+        self.html_cache_path = os.path.join(repo_path, '.html-rewrite-cache.json')
+        self.html_cache = {'pages': {}}
         self.force_reconvert = force_reconvert
+        self.max_workers = max_workers
+        self.avif_speed = avif_speed
+        self.session = self.create_session()
+        self.visited_lock = threading.Lock()
+        self.url_queue = queue.Queue()
+        self.crawl_stopped = threading.Event()
 
     def update_repo(self):
         try:
@@ -84,9 +435,43 @@ class ImprovedGhostStaticGenerator:
             print(f"An error occurred while updating the repository: {e}")
             print("Continuing with the rest of the script...")
 
+    def create_session(self):
+        # One pooled session is shared by all crawl workers so connections to the Ghost host are reused
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers * 2,
+                              max_retries=Retry(total=3, backoff_factor=0.3))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'User-Agent': 'ghost-static-generator/1.0', 'Accept-Encoding': 'gzip, deflate'})
+        return session
+
     def scrape_site(self):
-        self.scrape_url(self.source_url)
-        self.scrape_root_files()
+        self.http_cache = self.load_json(self.http_cache_path)
+        self.html_cache = self.load_json(self.html_cache_path)
+        self.html_cache.setdefault('pages', {})
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                workers = [executor.submit(self.crawl_worker) for _ in range(self.max_workers)]
+                try:
+                    self.scrape_url(self.source_url)
+                    self.scrape_root_files()
+
+                    # Wait until every discovered URL has been fetched
+                    self.url_queue.join()
+                except BaseException:
+                    # Interrupted or failed: let in-flight fetches finish but skip the rest
+                    self.crawl_stopped.set()
+                    raise
+                finally:
+                    # Stop the workers; without a sentinel each one stays blocked in
+                    # url_queue.get() and leaving the executor would wait on it forever
+                    for _ in workers:
+                        self.url_queue.put(None)
+        finally:
+            # Nothing is fetched after the crawl, so release the pooled connections
+            self.session.close()
+        self.save_json(self.http_cache_path, self.http_cache)
+        self.written_paths.add(self.http_cache_path)
     
     def scrape_root_files(self):
         root_files = [
@@ -103,69 +488,89 @@ class ImprovedGhostStaticGenerator:
             self.scrape_url(url)
 
     def scrape_url(self, url):
-        if url in self.visited_urls:
-            return
-        self.visited_urls.add(url)
-    
+        # Queue the URL for the crawl workers unless an equivalent one has already been seen;
+        # the URL itself is fetched, since the canonical form may encode the query differently
+        key = _canonical_url(url)
+        with self.visited_lock:
+            if key in self.visited_urls:
+                return
+            self.visited_urls.add(key)
+        self.url_queue.put(url)
+
+    def crawl_worker(self):
+        while True:
+            url = self.url_queue.get()
+            if url is None:
+                return
+            try:
+                if not self.crawl_stopped.is_set():
+                    self.fetch_url(url)
+            finally:
+                self.url_queue.task_done()
+
+    def conditional_headers(self, url):
+        # Revalidate assets saved by an earlier run instead of downloading them again
+        validators = self.http_cache.get(url)
+        if not validators or not os.path.exists(self.local_file_path(url)):
+            return {}
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def fetch_url(self, url):
         try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-    
-            content_type = response.headers.get('content-type', '').lower()
-            if 'text/html' in content_type:
-                self.process_html(url, response.text)
-                self.scrape_image_sizes(url)
-                self.scrape_meta_images(url)  # Add this line
-            elif 'image' in content_type:
-                self.file_urls.add(url)
-                self.save_file(url, response.content, os.path.splitext(urlparse(url).path)[1], is_binary=True)
-            elif any(type in content_type for type in ['text/css', 'javascript', 'application']):
-                self.file_urls.add(url)
-                self.save_file(url, response.content, os.path.splitext(urlparse(url).path)[1], is_binary=True)
-            else:
-                logging.info(f"Saving file with content-type {content_type}: {url}")
-                self.save_file(url, response.content, os.path.splitext(urlparse(url).path)[1], is_binary=True)
+            # Only the headers are read here; non-HTML bodies are streamed straight to disk
+            with self.session.get(url, timeout=30, stream=True, headers=self.conditional_headers(url)) as response:
+                response.raise_for_status()
+
+                if response.status_code == 304:
+                    self.file_urls.add(url)
+                    logging.info(f"Not modified: {url}")
+                    return
+        
+                content_type = response.headers.get('content-type', '').lower()
+                if 'text/html' in content_type:
+                    self.process_html(url, response.text)
+                    return
+
+                # Forget the old validators before streaming, so a download that dies midway
+                # is fetched in full next run instead of being revalidated with a 304
+                self.http_cache.pop(url, None)
+                if 'image' in content_type:
+                    self.file_urls.add(url)
+                    self.save_response(url, response)
+                elif any(type in content_type for type in ['text/css', 'javascript', 'application']):
+                    self.file_urls.add(url)
+                    self.save_response(url, response)
+                else:
+                    logging.info(f"Saving file with content-type {content_type}: {url}")
+                    self.save_response(url, response)
+
+                # Pages are always fetched in full: the saved copy has already been rewritten,
+                # so it can't be used to discover links. Only assets keep validators.
+                etag = response.headers.get('etag')
+                last_modified = response.headers.get('last-modified')
+                if etag or last_modified:
+                    self.http_cache[url] = {'etag': etag, 'last_modified': last_modified}
     
         except requests.exceptions.RequestException as e:
             logging.error(f"Error fetching {url}: {e}")
         except Exception as e:
             logging.error(f"Unexpected error scraping {url}: {str(e)}")
-    
-        time.sleep(0.1)
         
-    def scrape_meta_images(self, url):
-        try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error fetching URL {url}: {e}")
-            return
-    
+    def scrape_meta_images(self, url, soup):
         meta_images = soup.find_all('meta', property=['og:image', 'twitter:image'])
         for meta in meta_images:
             img_url = meta.get('content')
-            if img_url and self.is_same_domain(img_url):
-                try:
-                    img_response = requests.get(img_url, timeout=30)
-                    if img_response.status_code == 200:
-                        self.file_urls.add(img_url)
-                        self.save_file(img_url, img_response.content, os.path.splitext(img_url)[1], is_binary=True)
-                        logging.info(f"Scraped meta image: {img_url}")
-                    else:
-                        logging.warning(f"Failed to scrape meta image {img_url}: HTTP {img_response.status_code}")
-                except requests.exceptions.RequestException as e:
-                    logging.warning(f"Failed to scrape meta image {img_url}: {e}")
-
-    def scrape_image_sizes(self, url):
-        try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error fetching URL {url}: {e}")
-            return
-    
+            if img_url:
+                img_url = urljoin(url, img_url)
+                if self.is_same_domain(img_url):
+                    self.scrape_url(img_url)
+
+    def scrape_image_sizes(self, url, soup):
         for img in soup.find_all(['img', 'source']):
             srcset = img.get('srcset') or img.get('data-srcset', '')
             src = img.get('src') or img.get('data-src', '')
@@ -174,41 +579,16 @@ class ImprovedGhostStaticGenerator:
             all_urls.extend([s.split()[0] for s in srcset.split(',') if s.strip()])
             
             for img_url in all_urls:
-                if img_url and self.is_same_domain(img_url):
-                    try:
-                        img_response = requests.get(img_url, timeout=30)
-                        if img_response.status_code == 200:
-                            self.file_urls.add(img_url)
-                            self.save_file(img_url, img_response.content, os.path.splitext(img_url)[1], is_binary=True)
-                            logging.info(f"Scraped image: {img_url}")
-                        else:
-                            logging.warning(f"Failed to scrape image {img_url}: HTTP {img_response.status_code}")
-                    except requests.exceptions.RequestException as e:
-                        logging.warning(f"Failed to scrape image {img_url}: {e}")
-    
-        # Also check for background images in inline styles
-        for tag in soup.find_all(style=True):
-            style = tag['style']
-            urls = re.findall(r'url\([\'"]?([^\'"]+)[\'"]?\)', style)
-            for img_url in urls:
+                img_url = urljoin(url, img_url)
                 if self.is_same_domain(img_url):
-                    try:
-                        img_response = requests.get(img_url, timeout=30)
-                        if img_response.status_code == 200:
-                            self.file_urls.add(img_url)
-                            self.save_file(img_url, img_response.content, os.path.splitext(img_url)[1], is_binary=True)
-                            logging.info(f"Scraped background image: {img_url}")
-                        else:
-                            logging.warning(f"Failed to scrape background image {img_url}: HTTP {img_response.status_code}")
-                    except requests.exceptions.RequestException as e:
-                        logging.warning(f"Failed to scrape background image {img_url}: {e}")
+                    self.scrape_url(img_url)
 
     def scrape_iframe_content(self, iframe_src):
         if not self.is_same_domain(iframe_src):
             return
     
         try:
-            response = requests.get(iframe_src, timeout=30)
+            response = self.session.get(iframe_src, timeout=30)
             response.raise_for_status()
             iframe_content = response.text
     
@@ -216,7 +596,7 @@ class ImprovedGhostStaticGenerator:
             self.save_file(iframe_src, iframe_content, '.html')
     
             # Parse the iframe content
-            iframe_soup = BeautifulSoup(iframe_content, 'html.parser')
+            iframe_soup = BeautifulSoup(iframe_content, 'lxml', parse_only=IFRAME_STRAINER)
     
             # Find and scrape all script files
             for script in iframe_soup.find_all('script', src=True):
@@ -238,8 +618,7 @@ class ImprovedGhostStaticGenerator:
     
             # Look for any other resources that might be loaded dynamically
             # This is a simple regex search and might need to be adjusted based on your specific JS code
-            resource_pattern = re.compile(r'(["\'`])((?:\.{1,2}\/)*(?:[\w-]+\/)*[\w-]+\.(?:jpg|jpeg|png|gif|svg|js|css))\1')
-            for match in resource_pattern.finditer(iframe_content):
+            for match in IFRAME_RESOURCE_RE.finditer(iframe_content):
                 resource_path = match.group(2)
                 resource_url = urljoin(iframe_src, resource_path)
                 if self.is_same_domain(resource_url):
@@ -255,41 +634,46 @@ class ImprovedGhostStaticGenerator:
         # Make sure destination directory exists
         os.makedirs(destination_renders_path, exist_ok=True)
         
+        if not os.path.isdir(source_renders_path):
+            logging.info(f"No renders folder at {source_renders_path}, nothing to copy")
+            return
+        
         # Track stats
         files_copied = 0
         files_skipped = 0
         
         try:
-            # Walk through source directory
-            for root, dirs, files in os.walk(source_renders_path):
-                # Get the relative path from source
-                rel_path = os.path.relpath(root, source_renders_path)
-                dest_dir = os.path.join(destination_renders_path, rel_path)
+            # Walk the source with os.scandir, whose entries carry their own stat results;
+            # os.walk would need a separate stat for every file on top of its listing
+            directories = [(source_renders_path, destination_renders_path)]
+            while directories:
+                source_dir, dest_dir = directories.pop()
                 
                 # Create destination directory if it doesn't exist
                 os.makedirs(dest_dir, exist_ok=True)
                 
-                # Copy each file if it doesn't exist or is newer
-                for file in files:
-                    source_file = os.path.join(root, file)
-                    dest_file = os.path.join(dest_dir, file)
-                    
-                    # Check if we need to copy
-                    should_copy = False
-                    if not os.path.exists(dest_file):
-                        should_copy = True
-                    else:
-                        source_mtime = os.path.getmtime(source_file)
-                        dest_mtime = os.path.getmtime(dest_file)
-                        if source_mtime > dest_mtime:
+                with os.scandir(source_dir) as entries:
+                    for entry in entries:
+                        dest_file = os.path.join(dest_dir, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append((entry.path, dest_file))
+                            continue
+                        if not entry.is_file():
+                            continue
+                        
+                        # Copy the file if it doesn't exist or is newer
+                        try:
+                            should_copy = entry.stat().st_mtime > os.stat(dest_file).st_mtime
+                        except FileNotFoundError:
                             should_copy = True
-                    
-                    if should_copy:
-                        shutil.copy2(source_file, dest_file)
-                        files_copied += 1
-                        logging.info(f"Copied render file: {dest_file}")
-                    else:
-                        files_skipped += 1
+                        
+                        if should_copy:
+                            shutil.copy2(entry.path, dest_file)
+                            self.written_paths.add(dest_file)
+                            files_copied += 1
+                            logging.info(f"Copied render file: {dest_file}")
+                        else:
+                            files_skipped += 1
             
             logging.info(f"Renders folder sync complete: {files_copied} files copied, {files_skipped} unchanged files")
             
@@ -298,8 +682,20 @@ class ImprovedGhostStaticGenerator:
 
     
     def process_html(self, url, html_content):
-        self.save_file(url, html_content, '.html')
-        soup = BeautifulSoup(html_content, 'html.parser')
+        file_path = self.local_file_path(url)
+        page_key = os.path.relpath(file_path, self.public_dir)
+        source_digest = hashlib.sha256(html_content.encode('utf-8')).hexdigest()
+        page = self.html_cache['pages'].get(page_key)
+        # If Ghost serves the same page as last run, keep the rewritten copy on disk so the
+        # image rewrite can skip it; checking its digest guards against an interrupted run
+        if page and page[0] == source_digest and page[1] and self.file_digest(file_path) == page[1]:
+            logging.info(f"Page unchanged: {url}")
+        else:
+            self.save_file(url, html_content, '.html')
+            self.html_cache['pages'][page_key] = [source_digest, None]
+        soup = BeautifulSoup(html_content, 'lxml', parse_only=CRAWL_STRAINER)
+        self.scrape_image_sizes(url, soup)
+        self.scrape_meta_images(url, soup)
         
         for tag in soup.find_all(['a', 'link', 'script', 'img', 'source']):
             attr = tag.get('href') or tag.get('src') or tag.get('data-src')
@@ -315,235 +711,261 @@ class ImprovedGhostStaticGenerator:
                 iframe_url = urljoin(url, iframe_src)
                 if self.is_same_domain(iframe_url):
                     self.scrape_iframe_content(iframe_url)
-                    # Update iframe src to use the target URL
-                    iframe['src'] = self.update_url(iframe_url)
     
         # Process inline CSS and extract image URLs
         for style in soup.find_all('style'):
             css_content = style.string
             if css_content:
-                image_urls = re.findall(r'url\([\'"]?([^\'"]+)[\'"]?\)', css_content)
+                image_urls = CSS_URL_RE.findall(css_content)
                 for img_url in image_urls:
                     full_url = urljoin(url, img_url)
                     if self.is_same_domain(full_url):
                         self.scrape_url(full_url)
     
-        # Process inline style attributes
-        for tag in soup.find_all(style=True):
-            style_content = tag['style']
-            image_urls = re.findall(r'url\([\'"]?([^\'"]+)[\'"]?\)', style_content)
+        # Process inline style attributes; they can sit on any tag, so they are matched
+        # in the raw markup rather than through the strained tree
+        for match in STYLE_ATTR_RE.finditer(html_content):
+            style_content = html.unescape(match.group(2))
+            image_urls = CSS_URL_RE.findall(style_content)
             for img_url in image_urls:
                 full_url = urljoin(url, img_url)
                 if self.is_same_domain(full_url):
                     self.scrape_url(full_url)
-    
-        # Update the HTML content with the modified iframe src
-        updated_html = str(soup)
-        self.save_file(url, updated_html, '.html')
 
     def is_same_domain(self, url):
-        return urlparse(url).netloc == urlparse(self.source_url).netloc
+        return urlparse(url).netloc == self.source_netloc
 
-    def save_file(self, url, content, extension, is_binary=False):
+    def local_file_path(self, url):
         parsed_url = urlparse(url)
         relative_path = parsed_url.path.lstrip('/')
         if not relative_path:
             relative_path = 'index.html'
         elif relative_path.endswith('/'):
             relative_path += 'index.html'
-        
-        file_path = os.path.join(self.public_dir, relative_path)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return os.path.join(self.public_dir, relative_path)
+
+    def ensure_parent_dir(self, file_path):
+        # Most assets share a handful of directories; only call makedirs for new ones
+        directory = os.path.dirname(file_path)
+        if directory not in self.created_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self.created_dirs.add(directory)
+
+    def save_file(self, url, content, extension, is_binary=False):
+        file_path = self.local_file_path(url)
+        self.ensure_parent_dir(file_path)
         
         mode = 'wb' if is_binary else 'w'
         encoding = None if is_binary else 'utf-8'
-        with open(file_path, mode, encoding=encoding) as f:
-            f.write(content)
+        # URLs differing only in their query map to the same file, so another worker may be
+        # writing it too; each writes its own temporary file and the last replace wins
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, mode, encoding=encoding) as f:
+                f.write(content)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.written_paths.add(file_path)
         
         logging.info(f"Saved: {file_path}")
 
+    def save_response(self, url, response):
+        file_path = self.local_file_path(url)
+        self.ensure_parent_dir(file_path)
+        
+        # Stream into a temporary file and only move it into place once the download is
+        # complete, so an interrupted transfer never leaves a truncated asset behind. The name
+        # is per thread because URLs differing only in their query share the same local file
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        try:
+            # Copy from the socket in 1 MiB blocks; decode_content undoes any gzip transfer encoding
+            response.raw.decode_content = True
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(response.raw, f, length=1024 * 1024)
+                # urllib3 doesn't enforce Content-Length by default, so check for a short body
+                content_length = response.headers.get('content-length')
+                if content_length and not response.headers.get('content-encoding') and f.tell() != int(content_length):
+                    raise IOError(f"incomplete download, got {f.tell()} of {content_length} bytes")
+            
+            # Keep the origin's modification time so unchanged images aren't re-encoded
+            last_modified = response.headers.get('last-modified')
+            if last_modified:
+                try:
+                    timestamp = email.utils.parsedate_to_datetime(last_modified).timestamp()
+                    os.utime(tmp_path, (timestamp, timestamp))
+                except (TypeError, ValueError):
+                    pass
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.written_paths.add(file_path)
+        
+        logging.info(f"Saved: {file_path}")
+
+    def index_public_dir(self):
+        # Scan public/ once with os.scandir; the post-processing steps share the result
+        self.public_files = {}
+        directories = [self.public_dir]
+        while directories:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        self.public_files[entry.path] = (stat.st_size, stat.st_mtime)
+
+    def get_public_files(self):
+        # Maps each file under public/ to its (size, mtime)
+        if self.public_files is None:
+            self.index_public_dir()
+        return self.public_files
+
+    def add_public_file(self, file_path):
+        stat = os.stat(file_path)
+        self.get_public_files()[file_path] = (stat.st_size, stat.st_mtime)
+
     def convert_images(self):
-        def convert_to_webp(img_path):
-            output_path = f"{os.path.splitext(img_path)[0]}.webp"
-            if os.path.exists(output_path) and not self.force_reconvert:
-                logging.info(f"WebP already exists, skipping: {img_path}")
-                return True
-            try:
-                subprocess.run(['cwebp', '-q', '80', img_path, '-o', output_path], check=True)
-                logging.info(f"Converted to WebP: {img_path}")
-                return True
-            except subprocess.CalledProcessError as e:
-                logging.error(f"Error converting {img_path} to WebP: {str(e)}")
-                return False
-
-        def convert_to_avif(img_path):
-            output_path = f"{os.path.splitext(img_path)[0]}.avif"
-            if os.path.exists(output_path) and not self.force_reconvert:
-                logging.info(f"AVIF already exists, skipping: {img_path}")
-                return True
-            try:
-                # Use 4 threads for AVIF conversion
-                subprocess.run(['avifenc', '-s', '0', '-j', '4', '-d', '8', img_path, output_path], check=True)
-                logging.info(f"Converted to AVIF: {img_path}")
-                return True
-            except subprocess.CalledProcessError as e:
-                logging.error(f"Error converting {img_path} to AVIF: {str(e)}")
-                return False
-
-        def convert_to_jxl(img_path):
-            output_path = f"{os.path.splitext(img_path)[0]}.jxl"
-            if os.path.exists(output_path) and not self.force_reconvert:
-                logging.info(f"JXL already exists, skipping: {img_path}")
-                return True
-            try:
-                subprocess.run(['cjxl', img_path, output_path], check=True)
-                logging.info(f"Converted to JXL: {img_path}")
-                return True
-            except subprocess.CalledProcessError as e:
-                logging.error(f"Error converting {img_path} to JXL: {str(e)}")
-                return False
-            except FileNotFoundError:
-                logging.error("cjxl command not found. Please ensure JPEG XL tools are installed.")
-                return False
+        public_files = self.get_public_files()
+        manifest = self.load_json(self.manifest_path)
 
-        def process_image(img_path):
-            webp_success = convert_to_webp(img_path)
-            avif_success = convert_to_avif(img_path)
-            jxl_success = convert_to_jxl(img_path)
-            return webp_success, avif_success, jxl_success
+        # Encoding is CPU-bound, so use processes rather than threads. WebP and JXL run one
+        # single-threaded encoder per core; AVIF encoders are multi-threaded, so that stage
+        # gets half the workers with two threads each instead of oversubscribing the CPU
+        cpu_count = os.cpu_count() or 1
+        avif_workers = max(1, cpu_count // 2)
+        # Check for cjxl once rather than failing on every image when it isn't installed
+        jxl_available = shutil.which('cjxl') is not None
+        if not jxl_available:
+            logging.warning("cjxl not found, skipping JXL output. Install the JPEG XL tools to enable it.")
+        stages = [
+            (('webp', 'jxl') if jxl_available else ('webp',), cpu_count, 1),
+            (('avif',), avif_workers, max(1, cpu_count // avif_workers)),
+        ]
+        # The manifest records which formats each source was converted to, so sources are
+        # picked up again when a format becomes available (e.g. once cjxl is installed)
+        formats = sorted(format_ext for stage_formats, _, _ in stages for format_ext in stage_formats)
 
+        source_paths = []
         image_paths = []
-        for root, _, files in os.walk(self.public_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')) and (self.force_reconvert or not all(os.path.exists(f"{os.path.splitext(file_path)[0]}.{ext}") for ext in ['webp', 'avif', 'jxl'])):
-                    image_paths.append(file_path)
+        for file_path, (size, mtime) in list(public_files.items()):
+            base_path, extension = os.path.splitext(file_path)
+            extension = extension.lower()
+            # Decide by extension where possible; only sniff files that have none
+            if extension not in IMAGE_EXTENSIONS and (extension or not _has_image_signature(file_path)):
+                continue
+            if size < MIN_TRANSCODE_BYTES:
+                continue
+            source_paths.append(file_path)
+            if self.force_reconvert:
+                image_paths.append(file_path)
+                continue
+            # Sources converted by an earlier run at this exact size and mtime need no work
+            if manifest.get(os.path.relpath(file_path, self.public_dir)) == [size, mtime, formats]:
+                continue
+            outputs = [f"{base_path}.{ext}" for ext in formats]
+            if not all(output in public_files and public_files[output][1] >= mtime for output in outputs):
+                image_paths.append(file_path)
+
+        failed_paths = set()
+        for stage_formats, workers, encoder_threads in stages:
+            process_image = functools.partial(_convert_image, formats=stage_formats, force_reconvert=self.force_reconvert)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_encoder_worker, initargs=(encoder_threads, self.avif_speed)) as executor:
+                for img_path, (written_paths, discarded_paths, succeeded) in zip(image_paths, executor.map(process_image, image_paths, chunksize=4)):
+                    for output_path in written_paths:
+                        self.add_public_file(output_path)
+                        self.written_paths.add(output_path)
+                        self.removed_paths.discard(output_path)
+                    # A discarded output may be a stale copy the index and git still know about
+                    for output_path in discarded_paths:
+                        public_files.pop(output_path, None)
+                        self.written_paths.discard(output_path)
+                        self.removed_paths.add(output_path)
+                    if not succeeded:
+                        failed_paths.add(img_path)
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-            futures = [executor.submit(process_image, img_path) for img_path in image_paths]
-            for future in concurrent.futures.as_completed(futures):
-                future.result()
+        # Sources that failed are left out so the next run retries them
+        manifest = {os.path.relpath(path, self.public_dir): [*public_files[path], formats] for path in source_paths if path not in failed_paths}
+        self.save_json(self.manifest_path, manifest)
+        self.written_paths.add(self.manifest_path)
+
+    def load_json(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_json(self, path, data):
+        # Write to a temporary file and rename it so an interrupted run can't leave a truncated file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def file_digest(self, file_path):
+        try:
+            with open(file_path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return None
 
     def update_html_for_image_formats(self):
-        for root, _, files in os.walk(self.public_dir):
-            for file in files:
-                if file.endswith('.html'):
-                    file_path = os.path.join(root, file)
-                    logging.info(f"Processing HTML file: {file_path}")
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    soup = BeautifulSoup(content, 'html.parser')
-                    images_processed = 0
-    
-                    # Update Open Graph meta tags
-                    og_image = soup.find('meta', property='og:image')
-                    if og_image:
-                        og_image['content'] = self.update_url(og_image['content'])
-                        logging.info(f"Updated og:image: {og_image['content']}")
-    
-                    for img in soup.find_all('img'):
-                        src = img.get('src') or img.get('data-src')
-                        if not src:
-                            logging.warning(f"Image without src found in {file_path}")
-                            continue
-    
-                        logging.info(f"Processing image with src: {src}")
-    
-                        original_srcset = img.get('srcset') or img.get('data-srcset', '')
-                        sizes = img.get('sizes', '')
-    
-                        # Update src and srcset to use target URL
-                        img['src'] = self.update_url(src)
-                        if original_srcset:
-                            img['srcset'] = ', '.join([f"{self.update_url(s.split()[0])} {s.split()[1]}" if len(s.split()) > 1 else self.update_url(s) for s in original_srcset.split(',')])
-    
-                        # Create picture tag
-                        picture = soup.new_tag('picture')
-                        img.wrap(picture)
-    
-                        formats = [('webp', 'image/webp'), ('avif', 'image/avif'), ('jxl', 'image/jxl')]
-    
-                        for format_ext, format_type in formats:
-                            srcset = []
-                            for src_entry in original_srcset.split(','):
-                                src_entry = src_entry.strip()
-                                if src_entry:
-                                    parts = src_entry.split()
-                                    if len(parts) == 2:
-                                        orig_src, width = parts
-                                        new_src = re.sub(r'\.[^.]+$', f'.{format_ext}', orig_src)
-                                        local_path = self.url_to_local_path(new_src)
-                                        if local_path and os.path.exists(local_path):
-                                            srcset.append(f"{self.update_url(new_src)} {width}")
-                            
-                            if srcset:
-                                source = soup.new_tag('source', type=format_type)
-                                source['srcset'] = ', '.join(srcset)
-                                if sizes:
-                                    source['sizes'] = sizes
-                                picture.insert(0, source)
-                                logging.info(f"Created source for {format_type}")
-    
-                        # Ensure all original attributes of the img tag are preserved
-                        for attr, value in img.attrs.items():
-                            if attr not in ['src', 'srcset', 'sizes', 'data-src', 'data-srcset']:
-                                img[attr] = value
-    
-                        # Ensure lazy loading
-                        img['loading'] = 'lazy'
-                        
-                        images_processed += 1
-                    
-                    logging.info(f"Processed {images_processed} images in {file_path}")
-                    
-                    # Update all URLs in the HTML content
-                    content = self.update_all_urls(str(soup))
-                    
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        f.write(content)
-                    logging.info(f"Updated {file_path}")
-    
-    def update_url(self, url):
-        return url.replace(self.source_url, self.target_url)
-    
-    def update_all_urls(self, content):
-        return content.replace(self.source_url, self.target_url)
+        public_files = self.get_public_files()
+        html_paths = [file_path for file_path in public_files if file_path.endswith('.html')]
+        page_keys = [os.path.relpath(file_path, self.public_dir) for file_path in html_paths]
+        pages = self.html_cache['pages']
 
+        # A page still holding the output recorded last run needs no work, as long as the
+        # set of encoded images it may point at is the same as it was then
+        encoded_images = sorted(os.path.relpath(file_path, self.public_dir) for file_path in public_files if file_path.endswith(('.webp', '.avif', '.jxl')))
+        images_digest = hashlib.sha256('\n'.join(encoded_images).encode()).hexdigest()
+        if self.html_cache.get('images') == images_digest:
+            current_digests = [pages.get(page_key, [None, None])[1] for page_key in page_keys]
+        else:
+            current_digests = [None] * len(html_paths)
+
+        # Each HTML file is rewritten independently, so spread them over all cores
+        rewritten_pages = {}
+        initargs = (self.public_dir, self.source_url, self.target_url, frozenset(public_files))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_html_rewrite_worker, initargs=initargs) as executor:
+            results = executor.map(_rewrite_one_html, html_paths, current_digests, chunksize=8)
+            for file_path, page_key, (output_digest, written) in zip(html_paths, page_keys, results):
+                rewritten_pages[page_key] = [pages.get(page_key, [None, None])[0], output_digest]
+                if written:
+                    self.written_paths.add(file_path)
+
+        self.html_cache = {'images': images_digest, 'pages': rewritten_pages}
+        self.save_json(self.html_cache_path, self.html_cache)
+        self.written_paths.add(self.html_cache_path)
+    
     def update_urls_in_all_files(self):
-        for root, _, files in os.walk(self.public_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                _, file_extension = os.path.splitext(file)
+        # HTML files already had their URLs replaced by update_html_for_image_formats
+        source_bytes = self.source_url.encode()
+        target_bytes = self.target_url.encode()
+        for file_path, (size, _) in self.get_public_files().items():
+            _, file_extension = os.path.splitext(file_path)
+            
+            if size and file_extension.lower() in ['.xml', '.css', '.js', '.json']:
+                # Most assets never mention the source URL; searching a read-only mapping
+                # rules them out without copying the file into memory
+                with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if mapped.find(source_bytes) < 0:
+                        continue
+                    updated_content = mapped[:].replace(source_bytes, target_bytes)
                 
-                if file_extension.lower() in ['.html', '.xml', '.css', '.js', '.json']:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    updated_content = self.update_all_urls(content)
-                    
-                    # Update iframe src URLs
-                    if file_extension.lower() == '.html':
-                        soup = BeautifulSoup(updated_content, 'html.parser')
-                        for iframe in soup.find_all('iframe'):
-                            src = iframe.get('src')
-                            if src:
-                                iframe['src'] = self.update_url(src)
-                        updated_content = str(soup)
-                    
-                    if updated_content != content:
-                        with open(file_path, 'w', encoding='utf-8') as f:
-                            f.write(updated_content)
-                        logging.info(f"Updated URLs in {file_path}")
-
-    def url_to_local_path(self, url):
-        if url.startswith('/'):
-            return os.path.join(self.public_dir, url.lstrip('/'))
-        parsed_url = urllib.parse.urlparse(url)
-        if parsed_url.netloc and parsed_url.netloc not in [urllib.parse.urlparse(self.source_url).netloc, urllib.parse.urlparse(self.target_url).netloc]:
-            return None
-        relative_path = parsed_url.path.lstrip('/')
-        return os.path.join(self.public_dir, relative_path)
+                # Replace the file atomically so an interrupted run can't leave it truncated
+                tmp_path = f"{file_path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(updated_content)
+                os.replace(tmp_path, file_path)
+                self.written_paths.add(file_path)
+                logging.info(f"Updated URLs in {file_path}")
 
     def local_path_to_url(self, local_path, current_file_path):
         # Convert a local file path to a URL, handling both absolute and relative paths
@@ -556,24 +978,44 @@ class ImprovedGhostStaticGenerator:
             relative_path = os.path.relpath(local_path, os.path.dirname(current_file_path))
             return relative_path.replace('\\', '/')
 
-    def replace_urls_in_files(self):
-        for root, _, files in os.walk(self.public_dir):
-            for file in files:
-                if file.endswith(('.html', '.css', '.js')):
-                    file_path = os.path.join(root, file)
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    content = content.replace(self.source_url, self.target_url)
-                    content = content.replace("helium", "cadenkraft.com")
-                    
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        f.write(content)
+    def git_with_paths(self, command, paths, *options, **kwargs):
+        # The paths go over stdin, NUL-separated, in a single git call, so there is no
+        # argument length limit
+        with tempfile.TemporaryFile() as path_list:
+            path_list.write(b'\0'.join(os.fsencode(path) for path in paths))
+            path_list.seek(0)
+            return command(*options, istream=path_list, **kwargs)
+
+    def git_with_pathspec(self, command, paths, *options):
+        return self.git_with_paths(command, paths, *options, '--pathspec-from-file=-', '--pathspec-file-nul')
 
     def commit_and_push(self):
         try:
             repo = git.Repo(self.repo_path)
-            repo.git.add(A=True)
+            # Stage what this run wrote or removed instead of adding the whole worktree.
+            # Files from an earlier run that stopped before committing won't be written again
+            # (they revalidate with a 304 or are already converted), so also pick up anything
+            # git reports under public/ as untracked, modified or deleted
+            public_pathspec = os.path.relpath(self.public_dir, repo.working_tree_dir)
+            leftovers = repo.git.ls_files('-z', '--others', '--modified', '--exclude-standard', '--', public_pathspec)
+            leftover_paths = {os.path.join(repo.working_tree_dir, path) for path in leftovers.split('\0') if path}
+            written_paths = sorted(self.written_paths | leftover_paths)
+            removed_paths = sorted(self.removed_paths)
+            if written_paths:
+                # Naming a gitignored path makes git add fail where add -A skipped it, and the
+                # caches written every run are likely to be ignored. check-ignore exits 1 when
+                # nothing matches, which is not an error here
+                ignored = self.git_with_paths(repo.git.check_ignore, written_paths, '--stdin', '-z', with_exceptions=False)
+                ignored_paths = set(ignored.split('\0'))
+                written_paths = [path for path in written_paths if path not in ignored_paths]
+            if not written_paths and not removed_paths:
+                print("No files were written, nothing to commit")
+                return
+            if written_paths:
+                self.git_with_pathspec(repo.git.add, written_paths)
+            if removed_paths:
+                # Discarded image outputs; --ignore-unmatch skips the ones git never tracked
+                self.git_with_pathspec(repo.git.rm, removed_paths, '--cached', '--ignore-unmatch', '--quiet')
             repo.git.commit(m=f"Updated static site - {time.strftime('%Y-%m-%d %H:%M:%S')}")
             repo.git.push('origin', repo.active_branch.name)
             print("Changes committed and pushed successfully")
@@ -587,20 +1029,30 @@ class ImprovedGhostStaticGenerator:
         self.update_repo()
         self.scrape_site()
         self.copy_renders_folder()  # Now uses smart copy
+        self.index_public_dir()     # Single scan of public/ shared by the steps below
         self.convert_images()       # Will only convert images that haven't been converted already
         self.update_html_for_image_formats()
         self.update_urls_in_all_files()
         self.commit_and_push()
         logging.info("Static site generation process completed")
 
+def positive_int(value):
+    # With no workers the crawl queue would never be drained
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate static site from Ghost blog")
     parser.add_argument("--force-reconvert", action="store_true", help="Force reconversion of all images")
+    parser.add_argument("--workers", type=positive_int, default=16, help="Number of concurrent requests while scraping (default: 16)")
+    parser.add_argument("--avif-speed", type=int, default=6, choices=range(11), metavar="{0-10}", help="AVIF encoder speed, 0 is slowest with the best compression (default: 6)")
     args = parser.parse_args()
 
     source_url = "http://helium:2368"  # Change this to your local Ghost URL
     target_url = "https://cadenkraft.com"  # Change this to your target URL
     repo_path = "/home/ghost-static-site-gen"  # Change this to your local repo path
 
-    generator = ImprovedGhostStaticGenerator(source_url, target_url, repo_path, force_reconvert=args.force_reconvert)
+    generator = ImprovedGhostStaticGenerator(source_url, target_url, repo_path, force_reconvert=args.force_reconvert, max_workers=args.workers, avif_speed=args.avif_speed)
     generator.run()